@@ -3,6 +3,7 @@ import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -26,15 +27,23 @@ if not database_url:
     database_url = "sqlite:///service_orders.db"
 
 app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+engine_options = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
+    # Rows per multi-VALUES INSERT when executemany() is batched
+    "insertmanyvalues_page_size": 1000,
 }
+database = make_url(database_url)
+if database.get_driver_name() == "psycopg2":
+    # Let psycopg2 pack executemany() UPDATE/DELETE batches into fewer round-trips
+    engine_options["executemany_mode"] = "values_plus_batch"
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Configure file uploads
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # Initialize extensions
 db.init_app(app)
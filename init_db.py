@@ -4,24 +4,207 @@ Database initialization script for Service Order Management System
 Creates tables and populates with initial data
 """
 
+import itertools
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
+from sqlalchemy import create_engine, event, insert, text
+from sqlalchemy.pool import SingletonThreadPool
+from sqlalchemy.schema import CreateColumn
 from werkzeug.security import generate_password_hash
 
 # Add the current directory to Python path to import our modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app import app, db
-from models import User, Client, ServiceOrder, ServiceOrderItem, StandardService, CompanyInfo
+from models import User, Client, Vehicle, ServiceOrder, ServiceOrderItem, StandardService, CompanyInfo, item_totals_are_generated, next_os_numbers
 
-def init_database():
-    """Initialize the database with tables and sample data"""
+# Catalogue of standard services created by init_database()
+STANDARD_SERVICES = (
+    {
+        "name": "Troca de Óleo",
+        "description": "Troca de óleo do motor e filtro",
+        "suggested_price": 80.00,
+        "category": "Manutenção"
+    },
+    {
+        "name": "Alinhamento e Balanceamento",
+        "description": "Alinhamento da direção e balanceamento das rodas",
+        "suggested_price": 120.00,
+        "category": "Mecânica"
+    },
+    {
+        "name": "Revisão Geral",
+        "description": "Revisão completa do veículo",
+        "suggested_price": 200.00,
+        "category": "Manutenção"
+    },
+    {
+        "name": "Troca de Pastilhas de Freio",
+        "description": "Substituição das pastilhas de freio dianteiras",
+        "suggested_price": 150.00,
+        "category": "Mecânica"
+    },
+    {
+        "name": "Diagnóstico Eletrônico",
+        "description": "Diagnóstico completo do sistema eletrônico",
+        "suggested_price": 100.00,
+        "category": "Diagnóstico"
+    },
+    {
+        "name": "Troca de Bateria",
+        "description": "Substituição da bateria do veículo",
+        "suggested_price": 300.00,
+        "category": "Elétrica"
+    },
+    {
+        "name": "Reparo no Sistema Elétrico",
+        "description": "Diagnóstico e reparo de problemas elétricos",
+        "suggested_price": 180.00,
+        "category": "Elétrica"
+    },
+    {
+        "name": "Pintura Completa",
+        "description": "Pintura completa do veículo",
+        "suggested_price": 2500.00,
+        "category": "Pintura"
+    },
+    {
+        "name": "Funilaria e Pintura",
+        "description": "Reparo de lataria e pintura",
+        "suggested_price": 800.00,
+        "category": "Funilaria"
+    },
+    {
+        "name": "Troca de Pneus",
+        "description": "Montagem e balanceamento de pneus novos",
+        "suggested_price": 50.00,
+        "category": "Mecânica"
+    }
+)
+
+def set_sqlite_bulk_pragmas(dbapi_connection, connection_record):
+    """Trade durability for write speed on connections opened by this script"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=OFF")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+def tune_sqlite_for_bulk_load():
+    """Run the rest of this script on one reused, bulk-tuned SQLite connection
+
+    Swaps the app's engine, in this process only, for one that keeps a single
+    connection open (SingletonThreadPool) and applies the bulk-load PRAGMAs.
+    The app process never does this, so synchronous, temp_store and
+    mmap_size go back to SQLite's defaults there. journal_mode=WAL is stored
+    in the database file, though, so the app also runs in WAL mode after
+    every reset.
+    """
+    engine = db.engine
+    if engine.dialect.name != "sqlite" or engine.url.database in (None, "", ":memory:"):
+        return
+    if isinstance(engine.pool, SingletonThreadPool):
+        return
+    
+    engine.dispose()
+    bulk_engine = create_engine(engine.url, poolclass=SingletonThreadPool, pool_size=1)
+    event.listen(bulk_engine, "connect", set_sqlite_bulk_pragmas)
+    db.engines[None] = bulk_engine
+
+def drop_schema():
+    """Drop every table using the cheapest reset the database offers"""
+    engine = db.engine
+    database = engine.url.database
+    
+    if engine.dialect.name == "postgresql":
+        # One statement instead of introspecting and dropping table by table
+        with engine.begin() as conn:
+            conn.execute(text("DROP SCHEMA public CASCADE"))
+            conn.execute(text("CREATE SCHEMA public"))
+    elif engine.dialect.name == "sqlite" and database and database != ":memory:":
+        # Close pooled connections, then just delete the database file
+        engine.dispose()
+        for path in (database, f"{database}-wal", f"{database}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+    else:
+        db.drop_all()
+
+def defer_constraints():
+    """Check foreign keys once at commit instead of on every inserted row
+
+    PostgreSQL only; SQLite does not enforce foreign keys unless asked to.
+    """
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text("SET CONSTRAINTS ALL DEFERRED"))
+
+def migrate_item_totals(connection):
+    """Turn an existing plain service_order_item.total_price into the generated column
+
+    Existing rows keep their data; their totals are recomputed by the database.
+    """
+    if item_totals_are_generated(connection):
+        return False
+    
+    table = ServiceOrderItem.__table__
+    if connection.dialect.name == "postgresql":
+        total_price = CreateColumn(table.c.total_price).compile(dialect=connection.dialect)
+        connection.execute(text("ALTER TABLE service_order_item DROP COLUMN IF EXISTS total_price"))
+        connection.execute(text(f"ALTER TABLE service_order_item ADD COLUMN {total_price}"))
+    else:
+        # SQLite cannot add a stored generated column, so rebuild the table
+        columns = ", ".join(column.name for column in table.columns if column.computed is None)
+        connection.execute(text("ALTER TABLE service_order_item RENAME TO service_order_item_old"))
+        table.create(connection)
+        connection.execute(text(
+            f"INSERT INTO service_order_item ({columns}) SELECT {columns} FROM service_order_item_old"
+        ))
+        connection.execute(text("DROP TABLE service_order_item_old"))
+    return True
+
+def create_missing_indexes(connection):
+    """Create the model indexes that tables made by an older version lack
+
+    db.create_all() only creates indexes along with new tables. checkfirst
+    skips the ones already present, and dialect-specific (ddl_if) indexes
+    are still only created on their dialect.
+    """
+    if connection.dialect.name == "postgresql":
+        # The gin_trgm_ops indexes need the extension
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+def upgrade_database():
+    """Bring an existing database up to the current models without touching its data"""
+    with app.app_context():
+        with db.engine.begin() as connection:
+            if migrate_item_totals(connection):
+                print("Rebuilt service_order_item.total_price as a generated column")
+            
+            print("Creating missing indexes...")
+            create_missing_indexes(connection)
+        
+        print("Database upgraded successfully!")
+
+def init_database(sample=False):
+    """Initialize the database with tables and initial data
+
+    With sample=True the sample data is added in the same transaction,
+    so the whole seed is written with a single commit.
+    """
     
     with app.app_context():
+        tune_sqlite_for_bulk_load()
+        
         # Drop all tables and recreate them
         print("Dropping existing tables...")
-        db.drop_all()
+        drop_schema()
         
         print("Creating tables...")
         db.create_all()
@@ -41,108 +224,45 @@ def init_database():
         # Create default users
         print("Creating default users...")
         
-        # Admin user
-        admin_user = User(
-            username="admin",
-            email="admin@empresa.com",
-            password_hash=generate_password_hash("admin123"),
-            professional_name="Administrador",
-            is_admin=True,
-            is_active=True
-        )
-        db.session.add(admin_user)
+        # Password hashing is CPU-bound and hashlib releases the GIL, so hash all three at once
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            admin_hash, mechanic_hash, tech_hash = executor.map(
+                generate_password_hash, ["admin123", "mec123", "tec123"]
+            )
         
-        # Mechanic user
-        mechanic_user = User(
-            username="mecanico",
-            email="mecanico@empresa.com",
-            password_hash=generate_password_hash("mec123"),
-            professional_name="João Silva",
-            is_admin=False,
-            is_active=True
-        )
-        db.session.add(mechanic_user)
-        
-        # Technician user
-        tech_user = User(
-            username="tecnico",
-            email="tecnico@empresa.com",
-            password_hash=generate_password_hash("tec123"),
-            professional_name="Maria Santos",
-            is_admin=False,
-            is_active=True
-        )
-        db.session.add(tech_user)
-        
-        # Create standard services
-        print("Creating standard services...")
-        
-        standard_services = [
-            {
-                "name": "Troca de Óleo",
-                "description": "Troca de óleo do motor e filtro",
-                "suggested_price": 80.00,
-                "category": "Manutenção"
-            },
-            {
-                "name": "Alinhamento e Balanceamento",
-                "description": "Alinhamento da direção e balanceamento das rodas",
-                "suggested_price": 120.00,
-                "category": "Mecânica"
-            },
-            {
-                "name": "Revisão Geral",
-                "description": "Revisão completa do veículo",
-                "suggested_price": 200.00,
-                "category": "Manutenção"
-            },
-            {
-                "name": "Troca de Pastilhas de Freio",
-                "description": "Substituição das pastilhas de freio dianteiras",
-                "suggested_price": 150.00,
-                "category": "Mecânica"
-            },
-            {
-                "name": "Diagnóstico Eletrônico",
-                "description": "Diagnóstico completo do sistema eletrônico",
-                "suggested_price": 100.00,
-                "category": "Diagnóstico"
-            },
-            {
-                "name": "Troca de Bateria",
-                "description": "Substituição da bateria do veículo",
-                "suggested_price": 300.00,
-                "category": "Elétrica"
-            },
-            {
-                "name": "Reparo no Sistema Elétrico",
-                "description": "Diagnóstico e reparo de problemas elétricos",
-                "suggested_price": 180.00,
-                "category": "Elétrica"
-            },
+        db.session.execute(User.__table__.insert(), [
+            # Admin user
             {
-                "name": "Pintura Completa",
-                "description": "Pintura completa do veículo",
-                "suggested_price": 2500.00,
-                "category": "Pintura"
+                "username": "admin",
+                "email": "admin@empresa.com",
+                "password_hash": admin_hash,
+                "professional_name": "Administrador",
+                "is_admin": True
             },
+            # Mechanic user
             {
-                "name": "Funilaria e Pintura",
-                "description": "Reparo de lataria e pintura",
-                "suggested_price": 800.00,
-                "category": "Funilaria"
+                "username": "mecanico",
+                "email": "mecanico@empresa.com",
+                "password_hash": mechanic_hash,
+                "professional_name": "João Silva",
+                "is_admin": False
             },
+            # Technician user
             {
-                "name": "Troca de Pneus",
-                "description": "Montagem e balanceamento de pneus novos",
-                "suggested_price": 50.00,
-                "category": "Mecânica"
+                "username": "tecnico",
+                "email": "tecnico@empresa.com",
+                "password_hash": tech_hash,
+                "professional_name": "Maria Santos",
+                "is_admin": False
             }
-        ]
+        ])
         
-        for service_data in standard_services:
-            service = StandardService(**service_data)
-            db.session.add(service)
+        # Create standard services
+        print("Creating standard services...")
+        db.session.execute(StandardService.__table__.insert(), list(STANDARD_SERVICES))
+        
+        if sample:
+            add_sample_data()
         
         # Commit all changes
         print("Saving changes to database...")
@@ -153,163 +273,169 @@ def init_database():
         print("- Admin: admin / admin123")
         print("- Mecânico: mecanico / mec123")
         print("- Técnico: tecnico / tec123")
-        print(f"\nStandard services created: {len(standard_services)}")
+        print(f"\nStandard services created: {len(STANDARD_SERVICES)}")
         print("\nCompany information created with default values.")
         print("\nYou can now start the application with: python main.py")
 
-def create_sample_data():
-    """Create sample clients and service orders for demonstration"""
+def chunked(iterable, size):
+    """Yield lists of up to `size` items taken from `iterable`"""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+def sample_orders(admin_user, mechanic_user, client_ids, vehicle_ids):
+    """Yield (order, items) pairs for the sample service orders"""
+    # OS 1 - Completed and paid
+    yield {
+        "issue_date": date(2024, 12, 1),
+        "professional_id": mechanic_user.id,
+        "client_id": client_ids[0],
+        "vehicle_id": vehicle_ids[0],
+        "material_total": 80.00,
+        "labor_total": 50.00,
+        "final_total": 130.00,
+        "status": "Finalizado",
+        "payment_method": "PIX",
+        "is_paid": True,
+        "payment_date": datetime(2024, 12, 1, 16, 30)
+    }, [
+        {"name": "Óleo Motor 5W30", "quantity": 4, "unit_price": 15.00},
+        {"name": "Filtro de Óleo", "quantity": 1, "unit_price": 20.00}
+    ]
     
-    with app.app_context():
-        print("Creating sample data...")
-        
-        # Get users
-        admin_user = User.query.filter_by(username="admin").first()
-        mechanic_user = User.query.filter_by(username="mecanico").first()
-        
-        if not admin_user or not mechanic_user:
-            print("Users not found. Please run init_database() first.")
-            return
-        
-        # Create sample clients
-        sample_clients = [
-            {
-                "name": "Carlos Silva",
-                "phone": "(11) 98765-4321",
-                "license_plate": "ABC-1234",
-                "car_model": "Honda Civic 2018"
-            },
-            {
-                "name": "Ana Santos",
-                "phone": "(11) 87654-3210",
-                "license_plate": "DEF-5678",
-                "car_model": "Toyota Corolla 2020"
-            },
-            {
-                "name": "Pedro Oliveira",
-                "phone": "(11) 76543-2109",
-                "license_plate": "GHI-9012",
-                "car_model": "Volkswagen Gol 2019"
-            }
+    # OS 2 - In progress, not paid
+    yield {
+        "issue_date": date.today(),
+        "professional_id": admin_user.id,
+        "client_id": client_ids[1],
+        "vehicle_id": vehicle_ids[1],
+        "material_total": 300.00,
+        "labor_total": 200.00,
+        "final_total": 500.00,
+        "status": "Em andamento",
+        "payment_method": "Cartão de Crédito",
+        "is_paid": False
+    }, [
+        {"name": "Pastilhas de Freio", "quantity": 1, "unit_price": 150.00},
+        {"name": "Discos de Freio", "quantity": 2, "unit_price": 75.00}
+    ]
+    
+    # OS 3 - Completed, not paid
+    yield {
+        "issue_date": date(2024, 12, 10),
+        "professional_id": mechanic_user.id,
+        "client_id": client_ids[2],
+        "vehicle_id": vehicle_ids[2],
+        "material_total": 120.00,
+        "labor_total": 80.00,
+        "final_total": 200.00,
+        "status": "Finalizado",
+        "payment_method": "Dinheiro",
+        "is_paid": False,
+        "internal_observations": "Cliente prometeu pagar na próxima semana"
+    }, [
+        {"name": "Alinhamento", "quantity": 1, "unit_price": 60.00},
+        {"name": "Balanceamento", "quantity": 1, "unit_price": 60.00}
+    ]
+
+def add_sample_data():
+    """Add sample clients and service orders to the current session
+
+    Nothing is committed here so the caller decides the transaction boundary.
+    Returns False if the default users are missing.
+    """
+    print("Creating sample data...")
+    defer_constraints()
+    
+    # Get users
+    users = {
+        user.username: user
+        for user in User.query.filter(User.username.in_(("admin", "mecanico"))).all()
+    }
+    admin_user = users.get("admin")
+    mechanic_user = users.get("mecanico")
+    
+    if not admin_user or not mechanic_user:
+        print("Users not found. Please run init_database() first.")
+        return False
+    
+    # Create sample clients
+    sample_clients = [
+        {
+            "name": "Carlos Silva",
+            "phone": "(11) 98765-4321",
+            "license_plate": "ABC-1234",
+            "car_model": "Honda Civic 2018"
+        },
+        {
+            "name": "Ana Santos",
+            "phone": "(11) 87654-3210",
+            "license_plate": "DEF-5678",
+            "car_model": "Toyota Corolla 2020"
+        },
+        {
+            "name": "Pedro Oliveira",
+            "phone": "(11) 76543-2109",
+            "license_plate": "GHI-9012",
+            "car_model": "Volkswagen Gol 2019"
+        }
+    ]
+    
+    # INSERT ... RETURNING hands back every new id in a single round-trip,
+    # in the same order as the parameter list
+    client_ids = db.session.scalars(
+        insert(Client).returning(Client.id, sort_by_parameter_order=True),
+        [{"name": c["name"], "phone": c["phone"]} for c in sample_clients]
+    ).all()
+    vehicle_ids = db.session.scalars(
+        insert(Vehicle).returning(Vehicle.id, sort_by_parameter_order=True),
+        [
+            {"client_id": client_id, "license_plate": c["license_plate"], "car_model": c["car_model"]}
+            for client_id, c in zip(client_ids, sample_clients)
         ]
+    ).all()
+    
+    # Create sample service orders, streamed in chunks so memory stays flat
+    # however many orders the generator produces
+    chunk_size = 1000 if db.engine.dialect.name == "postgresql" else 500
+    order_count = item_count = 0
+    
+    for batch in chunked(sample_orders(admin_user, mechanic_user, client_ids, vehicle_ids), chunk_size):
+        orders = [
+            dict(order, os_number=os_number)
+            for (order, _), os_number in zip(batch, next_os_numbers(len(batch)))
+        ]
+        order_ids = db.session.scalars(
+            insert(ServiceOrder).returning(ServiceOrder.id, sort_by_parameter_order=True),
+            orders
+        ).all()
         
-        clients = []
-        for client_data in sample_clients:
-            client = Client(**client_data)
-            db.session.add(client)
-            clients.append(client)
-        
-        db.session.flush()  # Get IDs
-        
-        # Create sample service orders
-        from models import generate_os_number
-        
-        # OS 1 - Completed and paid
-        os1 = ServiceOrder(
-            os_number=generate_os_number(),
-            issue_date=date(2024, 12, 1),
-            professional_id=mechanic_user.id,
-            client_id=clients[0].id,
-            material_total=80.00,
-            labor_total=50.00,
-            final_total=130.00,
-            status="Finalizado",
-            payment_method="PIX",
-            is_paid=True,
-            payment_date=datetime(2024, 12, 1, 16, 30)
-        )
-        db.session.add(os1)
-        db.session.flush()
-        
-        # Add items to OS1
-        item1 = ServiceOrderItem(
-            service_order_id=os1.id,
-            name="Óleo Motor 5W30",
-            quantity=4,
-            unit_price=15.00,
-            total_price=60.00
-        )
-        item2 = ServiceOrderItem(
-            service_order_id=os1.id,
-            name="Filtro de Óleo",
-            quantity=1,
-            unit_price=20.00,
-            total_price=20.00
-        )
-        db.session.add_all([item1, item2])
-        
-        # OS 2 - In progress, not paid
-        os2 = ServiceOrder(
-            os_number=generate_os_number(),
-            issue_date=date.today(),
-            professional_id=admin_user.id,
-            client_id=clients[1].id,
-            material_total=300.00,
-            labor_total=200.00,
-            final_total=500.00,
-            status="Em andamento",
-            payment_method="Cartão de Crédito",
-            is_paid=False
-        )
-        db.session.add(os2)
-        db.session.flush()
-        
-        # Add items to OS2
-        item3 = ServiceOrderItem(
-            service_order_id=os2.id,
-            name="Pastilhas de Freio",
-            quantity=1,
-            unit_price=150.00,
-            total_price=150.00
-        )
-        item4 = ServiceOrderItem(
-            service_order_id=os2.id,
-            name="Discos de Freio",
-            quantity=2,
-            unit_price=75.00,
-            total_price=150.00
-        )
-        db.session.add_all([item3, item4])
-        
-        # OS 3 - Completed, not paid
-        os3 = ServiceOrder(
-            os_number=generate_os_number(),
-            issue_date=date(2024, 12, 10),
-            professional_id=mechanic_user.id,
-            client_id=clients[2].id,
-            material_total=120.00,
-            labor_total=80.00,
-            final_total=200.00,
-            status="Finalizado",
-            payment_method="Dinheiro",
-            is_paid=False,
-            internal_observations="Cliente prometeu pagar na próxima semana"
-        )
-        db.session.add(os3)
-        db.session.flush()
+        items = [
+            dict(item, service_order_id=order_id)
+            for order_id, (_, order_items) in zip(order_ids, batch)
+            for item in order_items
+        ]
+        if items:
+            db.session.execute(insert(ServiceOrderItem), items)
         
-        # Add items to OS3
-        item5 = ServiceOrderItem(
-            service_order_id=os3.id,
-            name="Alinhamento",
-            quantity=1,
-            unit_price=60.00,
-            total_price=60.00
-        )
-        item6 = ServiceOrderItem(
-            service_order_id=os3.id,
-            name="Balanceamento",
-            quantity=1,
-            unit_price=60.00,
-            total_price=60.00
-        )
-        db.session.add_all([item5, item6])
+        order_count += len(orders)
+        item_count += len(items)
+    
+    print(f"Sample data created:")
+    print(f"- {len(sample_clients)} clients")
+    print(f"- {len(vehicle_ids)} vehicles")
+    print(f"- {order_count} service orders")
+    print(f"- {item_count} service order items")
+    return True
+
+def create_sample_data():
+    """Create sample clients and service orders for demonstration"""
+    
+    with app.app_context():
+        tune_sqlite_for_bulk_load()
         
-        db.session.commit()
-        print(f"Sample data created:")
-        print(f"- {len(clients)} clients")
-        print(f"- 3 service orders")
-        print(f"- 6 service order items")
+        if add_sample_data():
+            db.session.commit()
 
 if __name__ == "__main__":
     import argparse
@@ -317,12 +443,13 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Initialize Service Order Management System database")
     parser.add_argument("--sample", action="store_true", help="Create sample data after initialization")
     parser.add_argument("--sample-only", action="store_true", help="Create only sample data (database must be initialized)")
+    parser.add_argument("--migrate", action="store_true", help="Upgrade an existing database in place, keeping its data")
     
     args = parser.parse_args()
     
-    if args.sample_only:
+    if args.migrate:
+        upgrade_database()
+    elif args.sample_only:
         create_sample_data()
     else:
-        init_database()
-        if args.sample:
-            create_sample_data()
+        init_database(sample=args.sample)
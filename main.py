@@ -1,4 +1,8 @@
 from app import app
+from models import require_current_schema
+
+with app.app_context():
+    require_current_schema()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
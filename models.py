@@ -1,7 +1,13 @@
 from app import db
 from flask_login import UserMixin
+import time
 from datetime import datetime
-from sqlalchemy import text
+from sqlalchemy import DDL, event, inspect, select, text, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# The trigram (gin_trgm_ops) indexes need the pg_trgm extension
+CREATE_PG_TRGM = DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -10,31 +16,47 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(256), nullable=False)
     professional_name = db.Column(db.String(100), nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
     
     # Relationship with service orders
-    service_orders = db.relationship('ServiceOrder', backref='professional', lazy=True)
+    service_orders = db.relationship('ServiceOrder', back_populates='professional', lazy='raise')
 
 class Client(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     phone = db.Column(db.String(20))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
     
     # Relationship with vehicles and service orders
-    vehicles = db.relationship('Vehicle', backref='client', lazy=True, cascade='all, delete-orphan')
-    service_orders = db.relationship('ServiceOrder', backref='client', lazy=True)
+    # (collections never lazy load: queries must use selectinload/joinedload)
+    vehicles = db.relationship('Vehicle', back_populates='client', lazy='raise', cascade='all, delete-orphan')
+    service_orders = db.relationship('ServiceOrder', back_populates='client', lazy='raise')
+    
+    __table_args__ = (
+        db.Index('ix_client_name', 'name'),
+        # Lets ILIKE '%term%' searches use an index on PostgreSQL
+        db.Index('ix_client_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
 
 class Vehicle(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id', deferrable=True), nullable=False)
     license_plate = db.Column(db.String(10), nullable=False)
     car_model = db.Column(db.String(100))
     year = db.Column(db.Integer)
     color = db.Column(db.String(50))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+    
+    client = db.relationship('Client', back_populates='vehicles')
+    
+    __table_args__ = (
+        db.Index('ix_vehicle_client_id', 'client_id'),
+        db.Index('ix_vehicle_license_plate_trgm', 'license_plate', postgresql_using='gin',
+                 postgresql_ops={'license_plate': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
     
     # Relationship with service orders will be handled via queries
 
@@ -45,19 +67,26 @@ class StandardService(db.Model):
     suggested_price = db.Column(db.Float, default=0.0)
     category = db.Column(db.String(50))
     is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    
+    __table_args__ = (
+        db.Index('ix_standard_service_active_name', 'is_active', 'name'),
+        # Lets ILIKE '%term%' searches use an index on PostgreSQL
+        db.Index('ix_standard_service_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
 
 class ServiceOrder(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     os_number = db.Column(db.String(20), unique=True, nullable=False)
-    issue_date = db.Column(db.Date, default=datetime.utcnow().date)
+    issue_date = db.Column(db.Date, server_default=db.func.current_date())
     
     # Professional responsible
-    professional_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    professional_id = db.Column(db.Integer, db.ForeignKey('user.id', deferrable=True), nullable=False)
     
     # Client and vehicle information
-    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
-    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id', deferrable=True), nullable=False)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id', deferrable=True), nullable=True)
     
     # Financial information
     material_total = db.Column(db.Float, default=0.0)
@@ -79,23 +108,77 @@ class ServiceOrder(db.Model):
     image_filename = db.Column(db.String(255))
     
     # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+    
+    # Relationships with professional, client and vehicle
+    professional = db.relationship('User', back_populates='service_orders')
+    client = db.relationship('Client', back_populates='service_orders')
+    vehicle = db.relationship('Vehicle')
     
     # Relationship with service items
-    items = db.relationship('ServiceOrderItem', backref='service_order', lazy=True, cascade='all, delete-orphan')
+    items = db.relationship('ServiceOrderItem', back_populates='service_order', lazy='raise', cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        # LIKE 'OS-YEAR-%' prefix scans; the unique index already covers SQLite
+        db.Index('ix_so_os_number_pattern', 'os_number',
+                 postgresql_ops={'os_number': 'text_pattern_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_so_os_number_trgm', 'os_number', postgresql_using='gin',
+                 postgresql_ops={'os_number': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        # Listings sort newest first; the status index also serves status-only filters
+        db.Index('ix_so_created_at', created_at.desc()),
+        db.Index('ix_so_status_paid', 'status', 'is_paid'),
+        db.Index('ix_so_is_paid_created', 'is_paid', 'created_at'),
+        db.Index('ix_so_issue_date', 'issue_date'),
+        db.Index('ix_so_professional_id', 'professional_id'),
+        db.Index('ix_so_client_id', 'client_id'),
+    )
+    
+    @classmethod
+    def list_summary(cls, limit=100):
+        """Latest orders as plain rows, skipping ORM object construction"""
+        return db.session.execute(
+            select(cls.id, cls.os_number, cls.final_total, cls.status, cls.is_paid)
+            .order_by(cls.id.desc())
+            .limit(limit)
+        ).all()
+
+# Only ask for the extension when a table with trigram indexes is being
+# created, so starting the app on an existing schema needs no CREATE privilege
+for trigram_table in (Client.__table__, Vehicle.__table__, StandardService.__table__, ServiceOrder.__table__):
+    event.listen(trigram_table, 'before_create', CREATE_PG_TRGM)
 
 class ServiceOrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    service_order_id = db.Column(db.Integer, db.ForeignKey('service_order.id'), nullable=False)
+    service_order_id = db.Column(db.Integer, db.ForeignKey('service_order.id', deferrable=True), nullable=False)
     
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     quantity = db.Column(db.Float, default=1.0)
     unit_price = db.Column(db.Float, default=0.0)
-    total_price = db.Column(db.Float, default=0.0)
+    total_price = db.Column(db.Numeric(12, 2), db.Computed('ROUND(CAST(quantity * unit_price AS NUMERIC), 2)', persisted=True))
+    
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
     
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    service_order = db.relationship('ServiceOrder', back_populates='items')
+
+def item_totals_are_generated(connection):
+    """Whether service_order_item.total_price is the generated column the models expect
+
+    db.create_all() never alters existing tables, so databases created before
+    the generated column keep a plain total_price until init_db.py --migrate.
+    """
+    columns = inspect(connection).get_columns(ServiceOrderItem.__tablename__)
+    return any(column['name'] == 'total_price' and column.get('computed') for column in columns)
+
+def require_current_schema():
+    """Refuse to serve from a database whose schema predates the current models"""
+    with db.engine.connect() as connection:
+        if not item_totals_are_generated(connection):
+            raise RuntimeError(
+                'service_order_item.total_price is not a generated column; '
+                'run "python init_db.py --migrate" to upgrade the database'
+            )
 
 class CompanyInfo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -106,31 +189,91 @@ class CompanyInfo(db.Model):
     logo_filename = db.Column(db.String(255), default='company_logo.svg')
     pix_qr_filename = db.Column(db.String(255), default='qr_pix.svg')
     
+    # Primary key of the singleton row, remembered after the first lookup
+    _cached_id = None
+    
+    # Read-only copy shared by every request in this process; the TTL bounds
+    # how long other workers keep serving values changed elsewhere
+    SNAPSHOT_TTL = 60
+    _snapshot = None
+    _snapshot_at = 0.0
+    
     @classmethod
     def get_instance(cls):
         """Get the singleton company info instance"""
+        if cls._cached_id is not None:
+            # Served from the session identity map when already loaded
+            instance = db.session.get(cls, cls._cached_id)
+            if instance:
+                return instance
+        
         instance = cls.query.first()
         if not instance:
             instance = cls()
             db.session.add(instance)
             db.session.commit()
+        cls._cached_id = instance.id
         return instance
+    
+    @classmethod
+    def get_cached(cls):
+        """Get a detached, read-only copy of the company info for rendering"""
+        now = time.monotonic()
+        if cls._snapshot is None or now - cls._snapshot_at > cls.SNAPSHOT_TTL:
+            instance = cls.get_instance()
+            cls._snapshot = cls(**{
+                column.key: getattr(instance, column.key)
+                for column in cls.__table__.columns
+            })
+            cls._snapshot_at = now
+        return cls._snapshot
+    
+    @classmethod
+    def invalidate(cls):
+        """Forget the cached singleton so the next call looks it up again"""
+        cls._cached_id = None
+        cls._snapshot = None
 
-# Function to generate OS number
-def generate_os_number():
-    from datetime import datetime
+class OsCounter(db.Model):
+    """Last OS sequence number issued for each year"""
+    year = db.Column(db.Integer, primary_key=True)
+    last_seq = db.Column(db.Integer, nullable=False, default=0)
+
+# Functions to generate OS numbers
+def next_os_numbers(count):
+    """Reserve the next `count` OS numbers of the current year"""
     current_year = datetime.now().year
+    prefix = f'OS-{current_year}-'
     
-    # Get the last OS number for current year
-    last_os = ServiceOrder.query.filter(
-        ServiceOrder.os_number.like(f'OS-{current_year}-%')
-    ).order_by(ServiceOrder.os_number.desc()).first()
+    # Atomically bump this year's counter and read the new value back
+    bump_counter = (
+        update(OsCounter)
+        .where(OsCounter.year == current_year)
+        .values(last_seq=OsCounter.last_seq + count)
+        .returning(OsCounter.last_seq)
+    )
+    last_number = db.session.execute(bump_counter).scalar()
     
-    if last_os:
-        # Extract the sequential number and increment
-        last_number = int(last_os.os_number.split('-')[-1])
-        next_number = last_number + 1
-    else:
-        next_number = 1
+    if last_number is None:
+        # First OS of the year (or counter not created yet):
+        # continue from the last OS number already stored
+        last_os = ServiceOrder.query.filter(
+            ServiceOrder.os_number.like(f'{prefix}%')
+        ).order_by(ServiceOrder.os_number.desc()).first()
+        last_seq = int(last_os.os_number[len(prefix):]) if last_os else 0
+        
+        # Concurrent requests may seed the counter at the same time;
+        # whoever loses the race keeps the winner's row and bumps it
+        insert = postgresql_insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite_insert
+        db.session.execute(
+            insert(OsCounter)
+            .values(year=current_year, last_seq=last_seq)
+            .on_conflict_do_nothing(index_elements=['year'])
+        )
+        last_number = db.session.execute(bump_counter).scalar()
     
-    return f'OS-{current_year}-{next_number:04d}'
+    first_number = last_number - count + 1
+    return [f'{prefix}{number:04d}' for number in range(first_number, last_number + 1)]
+
+def generate_os_number():
+    return next_os_numbers(1)[0]
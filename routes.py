@@ -1,9 +1,12 @@
-import os
 import io
-import pandas as pd
-from datetime import datetime, date
-from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, abort
+import csv
+import tempfile
+from itertools import zip_longest
+from datetime import datetime, date, time, timedelta
+from flask import render_template, request, redirect, url_for, flash, jsonify, abort, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
+from sqlalchemy import insert
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 from reportlab.lib.pagesizes import A4
@@ -12,27 +15,113 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib import colors
 from app import app, db
-from models import User, Client, Vehicle, ServiceOrder, ServiceOrderItem, StandardService, CompanyInfo, generate_os_number
-from utils import allowed_file, calculate_totals
+from models import User, Client, Vehicle, ServiceOrder, ServiceOrderItem, StandardService, CompanyInfo, generate_os_number, next_os_numbers
+from utils import allowed_file, calculate_totals, save_upload
+
+# Loader options for pages that show service orders with their related rows
+SERVICE_ORDER_LOADERS = (
+    joinedload(ServiceOrder.client),
+    joinedload(ServiceOrder.professional),
+    joinedload(ServiceOrder.vehicle),
+    selectinload(ServiceOrder.items),
+)
+
+# Same, for listings that never show the items
+SERVICE_ORDER_LIST_LOADERS = (
+    joinedload(ServiceOrder.client),
+    joinedload(ServiceOrder.professional),
+    joinedload(ServiceOrder.vehicle),
+)
+
+# Werkzeug's default password hash; older hashes (e.g. pbkdf2) are upgraded on login
+PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+
+# Browsers may reuse autocomplete answers while the user keeps typing
+AUTOCOMPLETE_CACHE_CONTROL = 'private, max-age=30'
+
+# Column order of the CSV export (also the headers import_csv reads)
+CSV_EXPORT_HEADER = [
+    'OS', 'Data', 'Cliente', 'Telefone', 'Placa', 'Modelo', 'Profissional',
+    'Total Material', 'Mão de Obra', 'Total Geral', 'Status', 'Pago', 'Forma Pagamento',
+]
+
+# PDF styles and layout, built once per process instead of on every request
+PDF_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=getSampleStyleSheet()['Heading1'],
+    fontSize=16,
+    spaceAfter=12,
+    alignment=1  # Center
+)
+PDF_INFO_COL_WIDTHS = [1.5*inch, 4*inch]
+PDF_ITEMS_COL_WIDTHS = [3*inch, 0.8*inch, 1*inch, 1*inch]
+PDF_ITEMS_HEADER = ['Item', 'Qtd', 'Valor Unit.', 'Total']
+# Long item lists are split into tables of this many rows; ReportLab's
+# table splitting gets quadratic on a single huge table
+PDF_ITEMS_ROWS_PER_TABLE = 200
+PDF_TOTALS_COL_WIDTHS = [2*inch, 2*inch]
+# Generated PDFs stay in memory up to this size, larger ones spill to disk
+PDF_SPOOL_MAX_SIZE = 64 * 1024
+PDF_STREAM_CHUNK_SIZE = 64 * 1024
+PDF_INFO_TABLE_STYLE = TableStyle([
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+])
+PDF_ITEMS_TABLE_STYLE = TableStyle([
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+])
+PDF_TOTALS_TABLE_STYLE = TableStyle([
+    ('FONTSIZE', (0, 0), (-1, -1), 12),
+    ('FONTNAME', (-1, -1), (-1, -1), 'Helvetica-Bold'),
+    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+])
+
+def parse_form_items(form):
+    """Read the item rows of a service order form as (name, quantity, unit_price)"""
+    # Lists of different lengths (a browser leaving out blank inputs) must not
+    # drop trailing items; missing values fall back to the defaults
+    return [
+        (name, float(quantity) if quantity else 1.0, float(price) if price else 0.0)
+        for name, quantity, price in zip_longest(
+            form.getlist('item_name[]'),
+            form.getlist('item_quantity[]'),
+            form.getlist('item_price[]'),
+            fillvalue=''
+        )
+        if name.strip()
+    ]
+
+def sum_item_totals(service_order_id):
+    """Sum the stored (cent-rounded) item totals of a service order"""
+    material_total = db.session.query(
+        db.func.coalesce(db.func.sum(ServiceOrderItem.total_price), 0)
+    ).filter(ServiceOrderItem.service_order_id == service_order_id).scalar()
+    return round(float(material_total), 2)
 
 @app.route('/')
 @login_required
 def dashboard():
     """Main dashboard with recent orders and statistics"""
     # Get recent orders
-    recent_orders = ServiceOrder.query.order_by(ServiceOrder.created_at.desc()).limit(10).all()
-    
-    # Get statistics
-    total_orders = ServiceOrder.query.count()
-    pending_orders = ServiceOrder.query.filter_by(status='Em andamento').count()
-    unpaid_orders = ServiceOrder.query.filter_by(is_paid=False).count()
-    
-    # Get today's revenue
-    today = date.today()
-    today_revenue = db.session.query(db.func.sum(ServiceOrder.final_total)).filter(
-        db.func.date(ServiceOrder.created_at) == today,
-        ServiceOrder.is_paid == True
-    ).scalar() or 0
+    recent_orders = ServiceOrder.query.options(*SERVICE_ORDER_LOADERS).order_by(ServiceOrder.created_at.desc()).limit(10).all()
+    
+    # Get statistics and today's revenue in a single round-trip
+    today_start = datetime.combine(date.today(), time.min)
+    tomorrow_start = today_start + timedelta(days=1)
+    total_orders, pending_orders, unpaid_orders, today_revenue = db.session.query(
+        db.func.count(ServiceOrder.id),
+        db.func.coalesce(db.func.sum(db.case((ServiceOrder.status == 'Em andamento', 1), else_=0)), 0),
+        db.func.coalesce(db.func.sum(db.case((ServiceOrder.is_paid == False, 1), else_=0)), 0),
+        db.func.coalesce(db.func.sum(db.case(
+            (db.and_(ServiceOrder.created_at >= today_start, ServiceOrder.created_at < tomorrow_start,
+                     ServiceOrder.is_paid == True),
+             ServiceOrder.final_total),
+            else_=0
+        )), 0)
+    ).one()
     
     return render_template('dashboard.html',
                          recent_orders=recent_orders,
@@ -51,6 +140,9 @@ def login():
         user = User.query.filter_by(username=username).first()
         
         if user and check_password_hash(user.password_hash, password):
+            if not user.password_hash.startswith(f'{PASSWORD_HASH_METHOD}$'):
+                user.password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+                db.session.commit()
             login_user(user)
             flash('Login realizado com sucesso!', 'success')
             return redirect(url_for('dashboard'))
@@ -92,7 +184,7 @@ def create_os():
                 # Update client info if provided
                 if client_phone:
                     client.phone = client_phone
-                client.updated_at = datetime.utcnow()
+                client.updated_at = db.func.now()
             
             # Handle vehicle
             vehicle_id = request.form.get('vehicle_id')
@@ -107,7 +199,13 @@ def create_os():
                 db.session.flush()
                 vehicle_id = vehicle.id
             
-            # Create service order
+            # Add items
+            items = [
+                ServiceOrderItem(name=name, quantity=quantity, unit_price=unit_price)
+                for name, quantity, unit_price in parse_form_items(request.form)
+            ]
+            
+            # Create service order; the items cascade in with it
             os_number = generate_os_number()
             service_order = ServiceOrder(
                 os_number=os_number,
@@ -121,47 +219,21 @@ def create_os():
                 surcharge_percentage=min(float(request.form.get('surcharge_percentage', 0)), 5.0),
                 payment_method=request.form.get('payment_method', ''),
                 status=request.form.get('status', 'Em andamento'),
-                internal_observations=request.form.get('internal_observations', '')
+                internal_observations=request.form.get('internal_observations', ''),
+                items=items
             )
-            
             db.session.add(service_order)
-            db.session.flush()  # Get the ID
+            db.session.flush()
             
-            # Add items
-            item_names = request.form.getlist('item_name[]')
-            item_quantities = request.form.getlist('item_quantity[]')
-            item_prices = request.form.getlist('item_price[]')
-            
-            material_total = 0
-            for i, name in enumerate(item_names):
-                if name.strip():
-                    quantity = float(item_quantities[i]) if item_quantities[i] else 1.0
-                    unit_price = float(item_prices[i]) if item_prices[i] else 0.0
-                    total_price = quantity * unit_price
-                    material_total += total_price
-                    
-                    item = ServiceOrderItem(
-                        service_order_id=service_order.id,
-                        name=name,
-                        quantity=quantity,
-                        unit_price=unit_price,
-                        total_price=total_price
-                    )
-                    db.session.add(item)
-            
-            # Update totals
-            service_order.material_total = material_total
+            # Totals come from the item totals as the database rounded them
+            service_order.material_total = sum_item_totals(service_order.id)
             service_order.final_total = calculate_totals(service_order)
             
             # Handle image upload
             if 'image' in request.files:
                 file = request.files['image']
                 if file and file.filename and allowed_file(file.filename):
-                    filename = secure_filename(f"{os_number}_{file.filename}")
-                    if not os.path.exists(app.config['UPLOAD_FOLDER']):
-                        os.makedirs(app.config['UPLOAD_FOLDER'])
-                    file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                    service_order.image_filename = filename
+                    service_order.image_filename = save_upload(file, secure_filename(f"{os_number}_{file.filename}"))
             
             db.session.commit()
             flash(f'Ordem de Serviço {os_number} criada com sucesso!', 'success')
@@ -172,7 +244,7 @@ def create_os():
             flash(f'Erro ao criar OS: {str(e)}', 'danger')
     
     # Get clients and standard services for the form
-    clients = Client.query.order_by(Client.name).all()
+    clients = Client.query.options(selectinload(Client.vehicles)).order_by(Client.name).all()
     standard_services = StandardService.query.filter_by(is_active=True).order_by(StandardService.name).all()
     
     return render_template('create_os.html', clients=clients, standard_services=standard_services)
@@ -181,15 +253,15 @@ def create_os():
 @login_required
 def view_os(os_id):
     """View service order details"""
-    service_order = ServiceOrder.query.get_or_404(os_id)
-    company_info = CompanyInfo.get_instance()
+    service_order = ServiceOrder.query.options(*SERVICE_ORDER_LOADERS).get_or_404(os_id)
+    company_info = CompanyInfo.get_cached()
     return render_template('edit_os.html', service_order=service_order, company_info=company_info, view_only=True)
 
 @app.route('/edit_os/<int:os_id>', methods=['GET', 'POST'])
 @login_required
 def edit_os(os_id):
     """Edit existing service order"""
-    service_order = ServiceOrder.query.get_or_404(os_id)
+    service_order = ServiceOrder.query.options(*SERVICE_ORDER_LOADERS).get_or_404(os_id)
     
     if request.method == 'POST':
         try:
@@ -199,7 +271,7 @@ def edit_os(os_id):
             client.phone = request.form.get('client_phone', '')
             client.license_plate = request.form.get('license_plate', '')
             client.car_model = request.form.get('car_model', '')
-            client.updated_at = datetime.utcnow()
+            client.updated_at = db.func.now()
             
             # Update service order
             service_order.labor_total = float(request.form.get('labor_total', 0))
@@ -210,54 +282,42 @@ def edit_os(os_id):
             service_order.payment_method = request.form.get('payment_method', '')
             service_order.status = request.form.get('status', 'Em andamento')
             service_order.internal_observations = request.form.get('internal_observations', '')
-            service_order.updated_at = datetime.utcnow()
+            service_order.updated_at = db.func.now()
             
             # Handle payment status
             if request.form.get('is_paid') == 'on':
                 if not service_order.is_paid:
                     service_order.is_paid = True
-                    service_order.payment_date = datetime.utcnow()
+                    service_order.payment_date = db.func.now()
             else:
                 service_order.is_paid = False
                 service_order.payment_date = None
             
-            # Clear existing items and add new ones
-            ServiceOrderItem.query.filter_by(service_order_id=service_order.id).delete()
+            # Replace the items with one DELETE and one batched INSERT
+            db.session.execute(
+                ServiceOrderItem.__table__.delete()
+                .where(ServiceOrderItem.service_order_id == service_order.id)
+            )
             
-            item_names = request.form.getlist('item_name[]')
-            item_quantities = request.form.getlist('item_quantity[]')
-            item_prices = request.form.getlist('item_price[]')
+            items = [{
+                'service_order_id': service_order.id,
+                'name': name,
+                'quantity': quantity,
+                'unit_price': unit_price
+            } for name, quantity, unit_price in parse_form_items(request.form)]
             
-            material_total = 0
-            for i, name in enumerate(item_names):
-                if name.strip():
-                    quantity = float(item_quantities[i]) if item_quantities[i] else 1.0
-                    unit_price = float(item_prices[i]) if item_prices[i] else 0.0
-                    total_price = quantity * unit_price
-                    material_total += total_price
-                    
-                    item = ServiceOrderItem(
-                        service_order_id=service_order.id,
-                        name=name,
-                        quantity=quantity,
-                        unit_price=unit_price,
-                        total_price=total_price
-                    )
-                    db.session.add(item)
+            if items:
+                db.session.execute(ServiceOrderItem.__table__.insert(), items)
             
-            # Update totals
-            service_order.material_total = material_total
+            # Update totals from the generated item totals
+            service_order.material_total = sum_item_totals(service_order.id)
             service_order.final_total = calculate_totals(service_order)
             
             # Handle image upload
             if 'image' in request.files:
                 file = request.files['image']
                 if file and file.filename and allowed_file(file.filename):
-                    filename = secure_filename(f"{service_order.os_number}_{file.filename}")
-                    if not os.path.exists(app.config['UPLOAD_FOLDER']):
-                        os.makedirs(app.config['UPLOAD_FOLDER'])
-                    file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                    service_order.image_filename = filename
+                    service_order.image_filename = save_upload(file, secure_filename(f"{service_order.os_number}_{file.filename}"))
             
             db.session.commit()
             flash('Ordem de Serviço atualizada com sucesso!', 'success')
@@ -266,9 +326,11 @@ def edit_os(os_id):
         except Exception as e:
             db.session.rollback()
             flash(f'Erro ao atualizar OS: {str(e)}', 'danger')
+            # The rollback expired the order; reload it with its items for the form
+            service_order = ServiceOrder.query.options(*SERVICE_ORDER_LOADERS).populate_existing().get_or_404(os_id)
     
-    company_info = CompanyInfo.get_instance()
-    clients = Client.query.order_by(Client.name).all()
+    company_info = CompanyInfo.get_cached()
+    clients = Client.query.options(selectinload(Client.vehicles)).order_by(Client.name).all()
     standard_services = StandardService.query.filter_by(is_active=True).order_by(StandardService.name).all()
     
     return render_template('edit_os.html', 
@@ -289,14 +351,20 @@ def history():
     date_from = request.args.get('date_from', '')
     date_to = request.args.get('date_to', '')
     
-    # Build query
-    query = ServiceOrder.query.join(Client)
+    # Build query; the joined client and vehicle rows fill the relationships
+    query = ServiceOrder.query.join(ServiceOrder.client).outerjoin(ServiceOrder.vehicle).options(
+        contains_eager(ServiceOrder.client),
+        contains_eager(ServiceOrder.vehicle),
+        joinedload(ServiceOrder.professional),
+        selectinload(ServiceOrder.items),
+    )
     
     if search:
+        # Served by the pg_trgm GIN indexes on PostgreSQL
         query = query.filter(
             db.or_(
                 Client.name.ilike(f'%{search}%'),
-                Client.license_plate.ilike(f'%{search}%'),
+                Vehicle.license_plate.ilike(f'%{search}%'),
                 ServiceOrder.os_number.ilike(f'%{search}%')
             )
         )
@@ -310,14 +378,18 @@ def history():
         query = query.filter(ServiceOrder.is_paid == False)
     
     if date_from:
-        query = query.filter(ServiceOrder.issue_date >= datetime.strptime(date_from, '%Y-%m-%d').date())
+        query = query.filter(ServiceOrder.issue_date >= date.fromisoformat(date_from))
     
     if date_to:
-        query = query.filter(ServiceOrder.issue_date <= datetime.strptime(date_to, '%Y-%m-%d').date())
+        query = query.filter(ServiceOrder.issue_date <= date.fromisoformat(date_to))
     
-    orders = query.order_by(ServiceOrder.created_at.desc()).all()
+    pagination = query.order_by(ServiceOrder.created_at.desc()).paginate(
+        page=request.args.get('page', 1, type=int),
+        per_page=50,
+        error_out=False
+    )
     
-    return render_template('history.html', orders=orders)
+    return render_template('history.html', orders=pagination.items, pagination=pagination)
 
 @app.route('/reports')
 @login_required
@@ -328,29 +400,38 @@ def reports():
     date_to = request.args.get('date_to', '')
     client_id = request.args.get('client_id', '')
     
-    # Base query
-    query = ServiceOrder.query
+    # Filters shared by the statistics and the order list
+    filters = []
     
     if date_from:
-        query = query.filter(ServiceOrder.issue_date >= datetime.strptime(date_from, '%Y-%m-%d').date())
+        filters.append(ServiceOrder.issue_date >= date.fromisoformat(date_from))
     
     if date_to:
-        query = query.filter(ServiceOrder.issue_date <= datetime.strptime(date_to, '%Y-%m-%d').date())
+        filters.append(ServiceOrder.issue_date <= date.fromisoformat(date_to))
     
     if client_id:
-        query = query.filter(ServiceOrder.client_id == client_id)
-    
-    orders = query.all()
-    
-    # Calculate statistics
-    total_revenue = sum(order.final_total for order in orders if order.is_paid)
-    pending_revenue = sum(order.final_total for order in orders if not order.is_paid)
-    total_orders = len(orders)
+        filters.append(ServiceOrder.client_id == client_id)
+    
+    # Calculate statistics in the database
+    total_revenue, pending_revenue, total_orders = db.session.query(
+        db.func.coalesce(db.func.sum(db.case((ServiceOrder.is_paid == True, ServiceOrder.final_total), else_=0)), 0),
+        db.func.coalesce(db.func.sum(db.case((ServiceOrder.is_paid == True, 0), else_=ServiceOrder.final_total)), 0),
+        db.func.count(ServiceOrder.id)
+    ).filter(*filters).one()
+    
+    pagination = ServiceOrder.query.options(*SERVICE_ORDER_LIST_LOADERS).filter(*filters).order_by(
+        ServiceOrder.created_at.desc()
+    ).paginate(
+        page=request.args.get('page', 1, type=int),
+        per_page=50,
+        error_out=False
+    )
     
     clients = Client.query.order_by(Client.name).all()
     
     return render_template('reports.html', 
-                         orders=orders,
+                         orders=pagination.items,
+                         pagination=pagination,
                          clients=clients,
                          total_revenue=total_revenue,
                          pending_revenue=pending_revenue,
@@ -360,7 +441,10 @@ def reports():
 @login_required
 def clients():
     """Client management"""
-    clients = Client.query.order_by(Client.name).all()
+    clients = Client.query.options(
+        selectinload(Client.vehicles),
+        selectinload(Client.service_orders)
+    ).order_by(Client.name).all()
     return render_template('clients.html', clients=clients)
 
 @app.route('/services')
@@ -374,26 +458,16 @@ def services():
 @login_required
 def generate_pdf(os_id):
     """Generate PDF for service order"""
-    service_order = ServiceOrder.query.get_or_404(os_id)
-    company_info = CompanyInfo.get_instance()
+    service_order = ServiceOrder.query.options(*SERVICE_ORDER_LOADERS).get_or_404(os_id)
+    company_info = CompanyInfo.get_cached()
     
-    # Create PDF in memory
-    buffer = io.BytesIO()
+    # Create PDF in a spooled buffer
+    buffer = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_SIZE)
     doc = SimpleDocTemplate(buffer, pagesize=A4)
     elements = []
     
-    # Styles
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        spaceAfter=12,
-        alignment=1  # Center
-    )
-    
     # Title
-    elements.append(Paragraph(f"ORDEM DE SERVIÇO - {service_order.os_number}", title_style))
+    elements.append(Paragraph(f"ORDEM DE SERVIÇO - {service_order.os_number}", PDF_TITLE_STYLE))
     elements.append(Spacer(1, 12))
     
     # Company info
@@ -404,11 +478,8 @@ def generate_pdf(os_id):
         ['CNPJ:', company_info.cnpj],
     ]
     
-    company_table = Table(company_data, colWidths=[1.5*inch, 4*inch])
-    company_table.setStyle(TableStyle([
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ]))
+    company_table = Table(company_data, colWidths=PDF_INFO_COL_WIDTHS)
+    company_table.setStyle(PDF_INFO_TABLE_STYLE)
     elements.append(company_table)
     elements.append(Spacer(1, 12))
     
@@ -425,33 +496,25 @@ def generate_pdf(os_id):
         ['Veículo:', vehicle_info],
     ]
     
-    client_table = Table(client_data, colWidths=[1.5*inch, 4*inch])
-    client_table.setStyle(TableStyle([
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ]))
+    client_table = Table(client_data, colWidths=PDF_INFO_COL_WIDTHS)
+    client_table.setStyle(PDF_INFO_TABLE_STYLE)
     elements.append(client_table)
     elements.append(Spacer(1, 12))
     
     # Items
     if service_order.items:
-        items_data = [['Item', 'Qtd', 'Valor Unit.', 'Total']]
-        for item in service_order.items:
-            items_data.append([
-                item.name,
-                str(item.quantity),
-                f'R$ {item.unit_price:.2f}',
-                f'R$ {item.total_price:.2f}'
-            ])
+        items_data = [[
+            item.name,
+            str(item.quantity),
+            f'R$ {item.unit_price:.2f}',
+            f'R$ {item.total_price:.2f}'
+        ] for item in service_order.items]
         
-        items_table = Table(items_data, colWidths=[3*inch, 0.8*inch, 1*inch, 1*inch])
-        items_table.setStyle(TableStyle([
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ]))
-        elements.append(items_table)
+        for start in range(0, len(items_data), PDF_ITEMS_ROWS_PER_TABLE):
+            rows = items_data[start:start + PDF_ITEMS_ROWS_PER_TABLE]
+            items_table = Table([PDF_ITEMS_HEADER] + rows, colWidths=PDF_ITEMS_COL_WIDTHS, repeatRows=1)
+            items_table.setStyle(PDF_ITEMS_TABLE_STYLE)
+            elements.append(items_table)
         elements.append(Spacer(1, 12))
     
     # Totals
@@ -461,60 +524,75 @@ def generate_pdf(os_id):
         ['Total Geral:', f'R$ {service_order.final_total:.2f}'],
     ]
     
-    totals_table = Table(totals_data, colWidths=[2*inch, 2*inch])
-    totals_table.setStyle(TableStyle([
-        ('FONTSIZE', (0, 0), (-1, -1), 12),
-        ('FONTNAME', (-1, -1), (-1, -1), 'Helvetica-Bold'),
-        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-    ]))
+    totals_table = Table(totals_data, colWidths=PDF_TOTALS_COL_WIDTHS)
+    totals_table.setStyle(PDF_TOTALS_TABLE_STYLE)
     elements.append(totals_table)
     
     # Build PDF
     doc.build(elements)
+    size = buffer.tell()
     buffer.seek(0)
     
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=f'{service_order.os_number}.pdf',
-        mimetype='application/pdf'
+    def generate():
+        # Read the buffer out in chunks; handing the file itself to the server
+        # lets it call fileno(), which forces even small PDFs onto disk
+        with buffer:
+            while chunk := buffer.read(PDF_STREAM_CHUNK_SIZE):
+                yield chunk
+    
+    return Response(
+        generate(),
+        mimetype='application/pdf',
+        headers={
+            'Content-Disposition': f'attachment; filename={service_order.os_number}.pdf',
+            'Content-Length': str(size)
+        }
     )
 
 @app.route('/export/csv')
 @login_required
 def export_csv():
     """Export service orders to CSV"""
-    orders = ServiceOrder.query.join(Client).join(User).all()
-    
-    data = []
-    for order in orders:
-        data.append({
-            'OS': order.os_number,
-            'Data': order.issue_date.strftime('%d/%m/%Y'),
-            'Cliente': order.client.name,
-            'Telefone': order.client.phone,
-            'Placa': order.client.license_plate,
-            'Modelo': order.client.car_model,
-            'Profissional': order.professional.professional_name,
-            'Total Material': order.material_total,
-            'Mão de Obra': order.labor_total,
-            'Total Geral': order.final_total,
-            'Status': order.status,
-            'Pago': 'Sim' if order.is_paid else 'Não',
-            'Forma Pagamento': order.payment_method,
-        })
-    
-    df = pd.DataFrame(data)
-    
-    buffer = io.BytesIO()
-    df.to_csv(buffer, index=False, encoding='utf-8')
-    buffer.seek(0)
+    orders = ServiceOrder.query.options(
+        joinedload(ServiceOrder.client),
+        joinedload(ServiceOrder.professional),
+        joinedload(ServiceOrder.vehicle)
+    ).order_by(ServiceOrder.id).yield_per(1000)
+    
+    def generate():
+        # Stream the file in ~64 KB pieces instead of building it in memory
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_EXPORT_HEADER)
+        
+        for order in orders:
+            writer.writerow([
+                order.os_number,
+                order.issue_date.strftime('%d/%m/%Y'),
+                order.client.name,
+                order.client.phone,
+                order.vehicle.license_plate if order.vehicle else '',
+                order.vehicle.car_model if order.vehicle else '',
+                order.professional.professional_name,
+                order.material_total,
+                order.labor_total,
+                order.final_total,
+                order.status,
+                'Sim' if order.is_paid else 'Não',
+                order.payment_method,
+            ])
+            if buffer.tell() >= 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        
+        yield buffer.getvalue()
     
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=f'ordens_servico_{datetime.now().strftime("%Y%m%d")}.csv',
-        mimetype='text/csv'
+    filename = f'ordens_servico_{datetime.now().strftime("%Y%m%d")}.csv'
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
     )
 
 @app.route('/import/csv', methods=['POST'])
@@ -531,39 +609,57 @@ def import_csv():
         return redirect(url_for('dashboard'))
     
     try:
-        df = pd.read_csv(file)
-        imported_count = 0
+        reader = csv.DictReader(io.TextIOWrapper(file.stream, encoding='utf-8-sig'))
+        rows = list(reader)
         
-        for _, row in df.iterrows():
-            # Create or get client
-            client = Client.query.filter_by(name=row['Cliente']).first()
-            if not client:
-                client = Client(
-                    name=row['Cliente'],
-                    phone=row.get('Telefone', ''),
-                    license_plate=row.get('Placa', ''),
-                    car_model=row.get('Modelo', '')
-                )
-                db.session.add(client)
-                db.session.flush()
-            
-            # Create service order
-            os_number = generate_os_number()
-            service_order = ServiceOrder(
-                os_number=os_number,
-                professional_id=current_user.id,
-                client_id=client.id,
-                material_total=float(row.get('Total Material', 0)),
-                labor_total=float(row.get('Mão de Obra', 0)),
-                final_total=float(row.get('Total Geral', 0)),
-                status=row.get('Status', 'Em andamento'),
-                payment_method=row.get('Forma Pagamento', ''),
-                is_paid=row.get('Pago', 'Não').lower() == 'sim'
+        # Look up every client named in the file with a single query
+        names = {row['Cliente'] for row in rows}
+        client_ids = dict(
+            db.session.query(Client.name, Client.id).filter(Client.name.in_(names)).all()
+        ) if names else {}
+        
+        # Create the missing clients (and their vehicles) in batches
+        new_clients = {}
+        for row in rows:
+            if row['Cliente'] not in client_ids:
+                new_clients.setdefault(row['Cliente'], row)
+        
+        if new_clients:
+            created = db.session.execute(
+                insert(Client).returning(Client.name, Client.id),
+                [{'name': name, 'phone': row.get('Telefone') or ''} for name, row in new_clients.items()]
             )
-            db.session.add(service_order)
-            imported_count += 1
+            client_ids.update(created.all())
+            
+            vehicles = [{
+                'client_id': client_ids[name],
+                'license_plate': row['Placa'],
+                'car_model': row.get('Modelo') or ''
+            } for name, row in new_clients.items() if row.get('Placa')]
+            if vehicles:
+                db.session.execute(Vehicle.__table__.insert(), vehicles)
+        
+        orders = []
+        for row in rows:
+            orders.append({
+                'professional_id': current_user.id,
+                'client_id': client_ids[row['Cliente']],
+                'material_total': float(row.get('Total Material') or 0),
+                'labor_total': float(row.get('Mão de Obra') or 0),
+                'final_total': float(row.get('Total Geral') or 0),
+                'status': row.get('Status') or 'Em andamento',
+                'payment_method': row.get('Forma Pagamento') or '',
+                'is_paid': (row.get('Pago') or 'Não').lower() == 'sim'
+            })
+        
+        # Number and insert all service orders in one batch
+        if orders:
+            for order, os_number in zip(orders, next_os_numbers(len(orders))):
+                order['os_number'] = os_number
+            db.session.execute(insert(ServiceOrder), orders)
         
         db.session.commit()
+        imported_count = len(orders)
         flash(f'{imported_count} ordens de serviço importadas com sucesso!', 'success')
         
     except Exception as e:
@@ -578,8 +674,10 @@ def import_csv():
 def api_clients():
     """Get clients list for autocomplete"""
     search = request.args.get('q', '')
-    clients = Client.query.filter(Client.name.ilike(f'%{search}%')).limit(10).all()
-    return jsonify([{
+    clients = Client.query.options(selectinload(Client.vehicles)).filter(
+        Client.name.ilike(f'%{search}%')
+    ).order_by(Client.name).limit(10).all()
+    response = jsonify([{
         'id': client.id,
         'name': client.name,
         'phone': client.phone or '',
@@ -589,6 +687,8 @@ def api_clients():
             'car_model': vehicle.car_model
         } for vehicle in client.vehicles]
     } for client in clients])
+    response.headers['Cache-Control'] = AUTOCOMPLETE_CACHE_CONTROL
+    return response
 
 @app.route('/api/services')
 @login_required
@@ -598,12 +698,27 @@ def api_services():
     services = StandardService.query.filter(
         StandardService.name.ilike(f'%{search}%'),
         StandardService.is_active == True
-    ).limit(10).all()
-    return jsonify([{
+    ).order_by(StandardService.name).limit(10).all()
+    response = jsonify([{
         'id': service.id,
         'name': service.name,
         'suggested_price': service.suggested_price
     } for service in services])
+    response.headers['Cache-Control'] = AUTOCOMPLETE_CACHE_CONTROL
+    return response
+
+@app.route('/api/service_orders')
+@login_required
+def api_service_orders():
+    """Get a lightweight summary of the latest service orders"""
+    limit = max(1, min(request.args.get('limit', 100, type=int), 500))
+    return jsonify([{
+        'id': order.id,
+        'os_number': order.os_number,
+        'final_total': order.final_total,
+        'status': order.status,
+        'is_paid': order.is_paid
+    } for order in ServiceOrder.list_summary(limit)])
 
 @app.route('/api/client_vehicles/<int:client_id>')
 @login_required
@@ -655,7 +770,7 @@ def settings():
         flash('Acesso negado. Apenas administradores podem acessar as configurações.', 'danger')
         return redirect(url_for('dashboard'))
     
-    company_info = CompanyInfo.get_instance()
+    company_info = CompanyInfo.get_cached()
     return render_template('settings.html', company_info=company_info)
 
 @app.route('/settings', methods=['POST'])
@@ -678,23 +793,16 @@ def update_settings():
         if 'logo' in request.files:
             logo_file = request.files['logo']
             if logo_file and logo_file.filename and allowed_file(logo_file.filename):
-                filename = secure_filename(f"logo_{logo_file.filename}")
-                if not os.path.exists(app.config['UPLOAD_FOLDER']):
-                    os.makedirs(app.config['UPLOAD_FOLDER'])
-                logo_file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                company_info.logo_filename = filename
+                company_info.logo_filename = save_upload(logo_file, secure_filename(f"logo_{logo_file.filename}"))
         
         # Handle PIX QR code upload
         if 'pix_qr' in request.files:
             pix_file = request.files['pix_qr']
             if pix_file and pix_file.filename and allowed_file(pix_file.filename):
-                filename = secure_filename(f"pix_{pix_file.filename}")
-                if not os.path.exists(app.config['UPLOAD_FOLDER']):
-                    os.makedirs(app.config['UPLOAD_FOLDER'])
-                pix_file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                company_info.pix_qr_filename = filename
+                company_info.pix_qr_filename = save_upload(pix_file, secure_filename(f"pix_{pix_file.filename}"))
         
         db.session.commit()
+        CompanyInfo.invalidate()
         flash('Configurações atualizadas com sucesso!', 'success')
         
     except Exception as e:
@@ -707,6 +815,6 @@ def update_settings():
 @login_required
 def print_os(os_id):
     """Print-friendly view of service order"""
-    service_order = ServiceOrder.query.get_or_404(os_id)
-    company_info = CompanyInfo.get_instance()
+    service_order = ServiceOrder.query.options(*SERVICE_ORDER_LOADERS).get_or_404(os_id)
+    company_info = CompanyInfo.get_cached()
     return render_template('print_os.html', service_order=service_order, company_info=company_info)
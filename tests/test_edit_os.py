@@ -0,0 +1,65 @@
+import os
+
+# Use a throwaway in-memory database; app.py reads this at import time
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+import pytest
+from jinja2 import ChoiceLoader, DictLoader
+
+from app import app, db
+from models import User, Client, ServiceOrder, ServiceOrderItem
+
+# Minimal stand-in for edit_os.html that touches the same data the real page does
+EDIT_OS_TEMPLATE = (
+    '{% for message in get_flashed_messages() %}{{ message }}{% endfor %}'
+    '{% for item in service_order.items %}[{{ item.name }}]{% endfor %}'
+)
+
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    app.jinja_loader = ChoiceLoader([DictLoader({'edit_os.html': EDIT_OS_TEMPLATE}), app.jinja_loader])
+    with app.test_client() as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def service_order_id():
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        customer = Client(name='Cliente Teste', phone='(11) 98888-7777')
+        db.session.add(customer)
+        db.session.flush()
+
+        service_order = ServiceOrder(
+            os_number='OS-TESTE-0001',
+            professional_id=admin.id,
+            client_id=customer.id,
+            items=[ServiceOrderItem(name='Filtro de óleo', quantity=1, unit_price=35.0)]
+        )
+        db.session.add(service_order)
+        db.session.commit()
+        return service_order.id
+
+
+def login(test_client):
+    with app.app_context():
+        admin_id = User.query.filter_by(username='admin').first().id
+    with test_client.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+        session['_fresh'] = True
+
+
+def test_edit_os_invalid_form_rerenders_with_items(client, service_order_id):
+    login(client)
+
+    response = client.post(f'/edit_os/{service_order_id}', data={
+        'client_name': 'Cliente Teste',
+        'labor_total': 'abc',
+    })
+
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'Erro ao atualizar OS' in body
+    assert '[Filtro de óleo]' in body
@@ -1,42 +1,61 @@
 import os
+from functools import lru_cache
+from flask import current_app
 from models import ServiceOrder
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
+ALLOWED_SUFFIXES = tuple(f'.{extension}' for extension in ALLOWED_EXTENSIONS)
+
+# Swaps the US digit separators for the Brazilian ones in a single pass
+CURRENCY_SEPARATORS = str.maketrans(',.', '.,')
+
+# Copy uploads to disk in 1 MiB writes instead of the default 16 KiB
+UPLOAD_BUFFER_SIZE = 1 << 20
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return filename.lower().endswith(ALLOWED_SUFFIXES)
+
+def save_upload(file, filename):
+    """Save an uploaded file into the upload folder"""
+    file.save(os.path.join(current_app.config['UPLOAD_FOLDER'], filename), buffer_size=UPLOAD_BUFFER_SIZE)
+    return filename
+
+def to_cents(value):
+    """Convert a monetary value to integer cents"""
+    return round(value * 100)
+
+# Discount amount in cents for each discount type, given the base total in cents
+DISCOUNT_CALCULATORS = {
+    'percentage': lambda base_cents, value: round(base_cents * value / 100),
+    'fixed': lambda base_cents, value: to_cents(value),
+}
 
 def calculate_totals(service_order):
     """Calculate final total with discounts and surcharges"""
-    # Base total: material + labor
-    base_total = service_order.material_total + service_order.labor_total
+    # Base total: material + labor, in integer cents to avoid float drift
+    base_cents = to_cents(service_order.material_total) + to_cents(service_order.labor_total)
     
     # Apply general budget if higher
-    if service_order.general_budget > base_total:
-        base_total = service_order.general_budget
+    base_cents = max(base_cents, to_cents(service_order.general_budget))
     
     # Apply discount
-    if service_order.discount_type == 'percentage':
-        discount_amount = base_total * (service_order.discount_value / 100)
-    elif service_order.discount_type == 'fixed':
-        discount_amount = service_order.discount_value
-    else:
-        discount_amount = 0
+    calculate_discount = DISCOUNT_CALCULATORS.get(service_order.discount_type)
+    discount_cents = calculate_discount(base_cents, service_order.discount_value) if calculate_discount else 0
     
-    total_after_discount = base_total - discount_amount
+    total_after_discount = base_cents - discount_cents
     
     # Apply surcharge (max 5%)
-    surcharge_amount = total_after_discount * (service_order.surcharge_percentage / 100)
+    surcharge_cents = round(total_after_discount * service_order.surcharge_percentage / 100)
     
-    final_total = total_after_discount + surcharge_amount
+    final_cents = total_after_discount + surcharge_cents
     
-    return max(final_total, 0)  # Ensure total is never negative
+    return max(final_cents, 0) / 100  # Ensure total is never negative
 
+@lru_cache(maxsize=4096)
 def format_currency(value):
-    """Format value as Brazilian currency"""
-    return f"R$ {value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+    """Format value as Brazilian currency (cached: the same totals repeat across rows)"""
+    return f"R$ {value:,.2f}".translate(CURRENCY_SEPARATORS)
 
 def format_date(date_obj):
     """Format date as dd/mm/yyyy"""